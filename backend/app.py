@@ -1,4 +1,4 @@
-import os, json
+import os
 try:
     import config as cfg  # backend/config.py
     for key in ("HF_API_KEY", "HF_MODEL", "SOCRATA_APP_TOKEN", "DATABASE_URL"):
@@ -7,19 +7,20 @@ try:
             os.environ[key] = str(val)
 except ImportError:
     pass
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from sqlalchemy import select
-from shapely.geometry import shape
+import numpy as np
+import orjson
+import shapely
 from shapely.strtree import STRtree
 
 from db import init_db, SessionLocal, User, Project
 from models import SaveProjectRequest, LoadProjectRequest, LLMQueryRequest, FilterRequest
 from services.llm import parse_filters
-from services.data_fetch import (
-    fetch_buildings_bbox, fetch_land_use_bbox, fetch_assessments_bbox,
-    norm_building, norm_land_use, norm_assess
-)
+from services.scene_cache import get_scene
+from services.data_fetch import fetch_scene_bbox, norm_land_use, norm_assess
+from services.scene import BuildingScene, NUMERIC_ATTRS
 
 # ---------- Config bootstrapping ----------
 # Try loading from backend/config.py (Python source config)
@@ -37,75 +38,123 @@ app = Flask(__name__)
 CORS(app)
 init_db()
 
+def ojsonify(obj, status=200):
+    """jsonify via orjson: much faster on large feature lists, and numpy values serialize as-is."""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype="application/json")
+
+def stream_features(head: dict, features, chunk=256):
+    """
+    Stream {**head, "features": [...]} without building the whole JSON document in memory:
+    features are orjson-encoded and sent `chunk` at a time.
+    """
+    def gen():
+        yield orjson.dumps(head)[:-1] + (b',"features":[' if head else b'"features":[')
+        for start in range(0, len(features), chunk):
+            part = b",".join(orjson.dumps(f, option=orjson.OPT_SERIALIZE_NUMPY) for f in features[start:start + chunk])
+            yield (b"," if start else b"") + part
+        yield b"]}"
+    return Response(stream_with_context(gen()), mimetype="application/json")
+
+@app.teardown_request
+def _close_session(_exc):
+    SessionLocal.remove()
+
 def ensure_user(session, username: str):
-    u = session.execute(select(User).where(User.username == username)).scalar_one_or_none()
+    """Get or create the user inside the caller's transaction (flush only; the caller commits)."""
+    u = session.execute(select(User).where(User.username == username).limit(1)).scalars().first()
     if not u:
         u = User(username=username)
-        session.add(u); session.commit()
+        session.add(u); session.flush()
     return u
 
-# ---------- Helpers (Shapely 2.x safe enrichment) ----------
-def enrich_with_zoning_and_assessment(buildings, landuse, assessments):
+# ---------- Helpers (Shapely 2.x bulk enrichment) ----------
+def _geoms(geojson_geoms):
+    """
+    (indices, geometries) for the non-empty GeoJSON geometry dicts. All of them are
+    parsed in one shapely.from_geojson call; invalid ones come back as None.
+    """
+    idx = np.array([i for i, g in enumerate(geojson_geoms) if g], dtype=np.intp)
+    raw = np.array([orjson.dumps(geojson_geoms[i]) for i in idx], dtype=object)
+    return idx, shapely.from_geojson(raw, on_invalid="ignore")
+
+def _to_float(v):
+    try:
+        return float(v) if v is not None else np.nan
+    except Exception:
+        return np.nan
+
+# Up to this many polygons a straight per-polygon contains_xy scan beats building a tree
+_SCAN_MAX_POLYS = 16
+
+def _first_containing(cx, cy, features):
+    """
+    For each point (cx[i], cy[i]), the index into `features` of the first polygon
+    containing it (-1 if none). Polygons are prepared and tested with contains_xy,
+    so no per-point Point objects are built in Python.
+    """
+    out = np.full(len(cx), -1, dtype=np.intp)
+    if not len(cx):
+        return out
+    feat_idx, polys = _geoms([f.get("geometry") for f in features])
+    if not len(feat_idx):
+        return out
+    shapely.prepare(polys)
+
+    # Few large polygons (typical zoning): one boolean mask per polygon
+    if len(polys) <= _SCAN_MAX_POLYS:
+        for j, poly in enumerate(polys):
+            mask = (out < 0) & shapely.contains_xy(poly, cx, cy)
+            out[mask] = feat_idx[j]
+        return out
+
+    # Many polygons (parcels): bbox candidates from one bulk tree query, then exact test
+    # node_capacity=10 is Shapely 2.x's default; spelled out so the tree shape is explicit
+    pt_idx, tree_idx = STRtree(polys, node_capacity=10).query(shapely.points(cx, cy))
+    hit = shapely.contains_xy(polys[tree_idx], cx[pt_idx], cy[pt_idx])
+    pt_idx, tree_idx = pt_idx[hit], tree_idx[hit]
+    # Overlapping polygons: keep the lowest feature index per point
+    order = np.lexsort((tree_idx, pt_idx))
+    pt_idx, tree_idx = pt_idx[order], tree_idx[order]
+    pt_idx, first = np.unique(pt_idx, return_index=True)
+    out[pt_idx] = feat_idx[tree_idx[first]]
+    return out
+
+def enrich_with_zoning_and_assessment(scene: BuildingScene, landuse, assessments):
     """
-    Uses STRtree.query(..., predicate='contains') which returns integer indices on Shapely 2.x.
-    Falls back to geometry iteration if predicate query isn't available.
+    Spatial join of building centroids against zoning and parcel polygons.
+    Centroid x/y arrays are computed once in a vectorized call and each overlay
+    is matched against all of them at once, instead of one GEOS round-trip per building.
+    Results are scattered straight into the scene's zoning/assessed_value columns.
     """
-    land_geoms = [shape(f["geometry"]) for f in landuse if f.get("geometry")]
-    assess_geoms = [shape(f["geometry"]) for f in assessments if f.get("geometry")]
-    land_tree = STRtree(land_geoms) if land_geoms else None
-    assess_tree = STRtree(assess_geoms) if assess_geoms else None
-
-    for b in buildings:
-        b["zoning"] = "Unknown"
-        b["assessed_value"] = None
-        if not b.get("geometry"):
-            continue
-        c = shape(b["geometry"]).centroid
-
-        # --- Land use (zoning)
-        if land_tree:
-            try:
-                idxs = land_tree.query(c, predicate="contains")  # ndarray of indices on Shapely 2.x
-                if len(idxs):
-                    idx = int(idxs[0])
-                    b["zoning"] = landuse[idx]["zoning"]
-                else:
-                    # Fallback loop (should rarely run)
-                    for i, poly in enumerate(land_geoms):
-                        if poly.contains(c):
-                            b["zoning"] = landuse[i]["zoning"]
-                            break
-            except Exception:
-                # Ultra-safe fallback
-                for i, poly in enumerate(land_geoms):
-                    try:
-                        if poly.contains(c):
-                            b["zoning"] = landuse[i]["zoning"]
-                            break
-                    except Exception:
-                        continue
-
-        # --- Assessments (property value)
-        if assess_tree:
-            try:
-                idxs = assess_tree.query(c, predicate="contains")
-                if len(idxs):
-                    idx = int(idxs[0])
-                    b["assessed_value"] = assessments[idx]["assessed_value"]
-                else:
-                    for i, poly in enumerate(assess_geoms):
-                        if poly.contains(c):
-                            b["assessed_value"] = assessments[i]["assessed_value"]
-                            break
-            except Exception:
-                for i, poly in enumerate(assess_geoms):
-                    try:
-                        if poly.contains(c):
-                            b["assessed_value"] = assessments[i]["assessed_value"]
-                            break
-                    except Exception:
-                        continue
-    return buildings
+    has_geom, geoms = _geoms(scene.geoms)
+    centroids = shapely.centroid(geoms)
+    # Empty geometries give POINT EMPTY, which get_x rejects; None reads as NaN and never matches
+    centroids[shapely.is_empty(centroids)] = None
+    cx, cy = shapely.get_x(centroids), shapely.get_y(centroids)
+    land_hit = _first_containing(cx, cy, landuse)
+    assess_hit = _first_containing(cx, cy, assessments)
+
+    scene.zoning[:] = "Unknown"
+    scene.assessed_value[:] = np.nan
+    zoning = np.array([f["zoning"] for f in landuse], dtype=object)
+    hit = land_hit >= 0
+    scene.zoning[has_geom[hit]] = zoning[land_hit[hit]]
+    values = np.array([_to_float(f["assessed_value"]) for f in assessments], dtype=np.float64)
+    hit = assess_hit >= 0
+    scene.assessed_value[has_geom[hit]] = values[assess_hit[hit]]
+    return scene
+
+def fetch_layers(bbox: str):
+    """Fetch buildings, land use and assessments concurrently, then normalize."""
+    buildings_raw, landuse_raw, assess_raw = fetch_scene_bbox(bbox)
+    buildings = BuildingScene.from_features(buildings_raw)
+    landuse   = [norm_land_use(f)   for f in landuse_raw]
+    assessments = [norm_assess(f)   for f in assess_raw]
+    return buildings, landuse, assessments
+
+def build_scene(bbox: str):
+    buildings, landuse, assessments = fetch_layers(bbox)
+    return enrich_with_zoning_and_assessment(buildings, landuse, assessments).to_features()
 # -----------------------------------------------------------
 
 @app.get("/api/scene")
@@ -114,7 +163,7 @@ def scene():
 
     # --- Fast mock mode so you can wire frontend immediately ---
     if request.args.get("mock") == "1":
-        return jsonify({
+        return ojsonify({
             "bbox": bbox,
             "features": [
                 {
@@ -158,16 +207,12 @@ def scene():
 
     # --- Real data path (bullet-proofed) ---
     try:
-        buildings = [norm_building(f) for f in fetch_buildings_bbox(bbox)]
-        landuse   = [norm_land_use(f)   for f in fetch_land_use_bbox(bbox)]
-        assessments = [norm_assess(f)   for f in fetch_assessments_bbox(bbox)]
-
-        buildings = enrich_with_zoning_and_assessment(buildings, landuse, assessments)
-        return jsonify({"bbox": bbox, "features": buildings})
+        buildings = get_scene(bbox, build_scene)
+        return stream_features({"bbox": bbox}, buildings)
     except Exception as e:
         # Log for you; never crash the client
         print("SCENE ERROR:", repr(e))
-        return jsonify({"bbox": bbox, "features": [], "error": str(e)}), 200
+        return ojsonify({"bbox": bbox, "features": [], "error": str(e)})
 
 @app.post("/api/llm/filter")
 def llm_filter():
@@ -175,60 +220,76 @@ def llm_filter():
     filters, note = parse_filters(req.query)
     return jsonify({"filters": filters, "note": note})
 
-def apply_filters(features, filters):
-    def ok(f, spec):
+# Attributes only known after enrich_with_zoning_and_assessment; everything else comes from building_row
+ENRICHED_ATTRS = ("zoning", "assessed_value")
+
+def apply_filters(scene: BuildingScene, filters) -> BuildingScene:
+    """
+    Each attribute is taken from the scene as a numpy column once; every filter is then
+    one vectorized comparison and the masks are AND-ed together.
+    Missing or non-numeric values never match a numeric filter (NaN compares False).
+    """
+    columns = {}
+    def column(attr):
+        if attr not in columns:
+            columns[attr] = scene.column(attr)
+        return columns[attr]
+
+    mask = np.ones(len(scene), dtype=bool)
+    for spec in filters:
         attr, op, val = spec["attribute"], spec["operator"], spec["value"]
-        fv = f.get(attr)
-        if attr in ["height_m", "assessed_value", "levels"]:
-            try:
-                fv = float(fv) if fv is not None else None
-                val = float(val)
-            except Exception:
-                return False
-            if fv is None:
-                return False
-            return (
-                (op == ">"  and fv >  val) or
-                (op == "<"  and fv <  val) or
-                (op == ">=" and fv >= val) or
-                (op == "<=" and fv <= val) or
-                (op == "="  and abs(fv - val) < 1e-6)
-            )
-        sv, sval = str(fv or "").lower(), str(val).lower()
-        if op == "=":         return sv == sval
-        if op == "contains":  return sval in sv
-        if op == "in" and isinstance(val, list): return sv in [str(x).lower() for x in val]
-        return False
-    return [f for f in features if all(ok(f, s) for s in filters)]
+        arr = column(attr)
+        if attr in NUMERIC_ATTRS:
+            val = _to_float(val)
+            if   op == ">":  m = arr >  val
+            elif op == "<":  m = arr <  val
+            elif op == ">=": m = arr >= val
+            elif op == "<=": m = arr <= val
+            elif op == "=":  m = np.abs(arr - val) < 1e-6
+            else:            m = np.zeros(len(arr), dtype=bool)
+        else:
+            sval = str(val).lower()
+            if op == "=":          m = arr == sval
+            elif op == "contains": m = np.char.find(arr, sval) >= 0
+            elif op == "in" and isinstance(val, list):
+                m = np.isin(arr, [str(x).lower() for x in val])
+            else:                  m = np.zeros(len(arr), dtype=bool)
+        mask &= m
+    return scene.take(np.flatnonzero(mask))
 
 @app.post("/api/filter")
 def filter_endpoint():
     req = FilterRequest(**(request.get_json(force=True) or {}))
-    buildings = [norm_building(f) for f in fetch_buildings_bbox(req.bbox)]
-    landuse   = [norm_land_use(f)   for f in fetch_land_use_bbox(req.bbox)]
-    assessments = [norm_assess(f)   for f in fetch_assessments_bbox(req.bbox)]
+    buildings, landuse, assessments = fetch_layers(req.bbox)
+    filters = [s.model_dump() if hasattr(s, "model_dump") else s for s in req.filters]
 
-    buildings = enrich_with_zoning_and_assessment(buildings, landuse, assessments)
-    matched = apply_filters(buildings, [s.model_dump() if hasattr(s, "model_dump") else s for s in req.filters])
+    # Filter on raw attributes first so the spatial join only runs for survivors
+    pre  = [s for s in filters if s["attribute"] not in ENRICHED_ATTRS]
+    post = [s for s in filters if s["attribute"] in ENRICHED_ATTRS]
+    matched = apply_filters(buildings, pre)
+    if post:
+        matched = enrich_with_zoning_and_assessment(matched, landuse, assessments)
+        matched = apply_filters(matched, post)
 
-    return jsonify({
-        "ids":   [m.get("id") for m in matched if m.get("id") is not None],
+    return ojsonify({
+        "ids":   [i for i in matched.ids.tolist() if i is not None],
         "count": len(matched),
-        "filters": req.filters
+        "filters": filters
     })
 
 @app.get("/api/projects")
 def list_projects():
     username = request.args.get("username", "demo")
-    s = SessionLocal(); u = ensure_user(s, username)
-    rows = s.execute(
-        select(Project).where(Project.user_id == u.id).order_by(Project.created_at.desc())
-    ).scalars().all()
-    return jsonify([
+    with SessionLocal.begin():
+        u = ensure_user(SessionLocal, username)
+        rows = SessionLocal.execute(
+            select(Project).where(Project.user_id == u.id).order_by(Project.created_at.desc())
+        ).scalars().all()
+    return ojsonify([
         {
             "id": r.id,
             "name": r.name,
-            "filters": json.loads(r.filters_json),
+            "filters": orjson.loads(r.filters_json),
             "bbox": r.bbox,
             "created_at": r.created_at.isoformat()
         } for r in rows
@@ -237,26 +298,29 @@ def list_projects():
 @app.post("/api/projects/save")
 def save_project():
     req = SaveProjectRequest(**(request.get_json(force=True) or {}))
-    s = SessionLocal(); u = ensure_user(s, req.username)
-    p = Project(
-        user_id=u.id,
-        name=req.name,
-        filters_json=json.dumps([f.model_dump() if hasattr(f, "model_dump") else f for f in req.filters]),
-        bbox=req.bbox
-    )
-    s.add(p); s.commit()
-    return jsonify({"project_id": p.id})
+    # User ensure + project insert in one transaction: a single commit
+    with SessionLocal.begin():
+        u = ensure_user(SessionLocal, req.username)
+        p = Project(
+            user_id=u.id,
+            name=req.name,
+            filters_json=orjson.dumps([f.model_dump() if hasattr(f, "model_dump") else f for f in req.filters]).decode(),
+            bbox=req.bbox
+        )
+        SessionLocal.add(p); SessionLocal.flush()
+        pid = p.id
+    return ojsonify({"project_id": pid})
 
 @app.post("/api/projects/load")
 def load_project():
     req = LoadProjectRequest(**(request.get_json(force=True) or {}))
-    s = SessionLocal(); row = s.get(Project, req.project_id)
+    row = SessionLocal.get(Project, req.project_id)
     if not row:
-        return jsonify({"error": "not found"}), 404
-    return jsonify({
+        return ojsonify({"error": "not found"}, 404)
+    return ojsonify({
         "id": row.id,
         "name": row.name,
-        "filters": json.loads(row.filters_json),
+        "filters": orjson.loads(row.filters_json),
         "bbox": row.bbox
     })
 
@@ -1,12 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from datetime import datetime
 import os
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///city3d.sqlite")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+else:
+    # Pooled connections for server databases; pre_ping/recycle drop connections the server has closed
+    engine = create_engine(DATABASE_URL, pool_size=10, max_overflow=20, pool_pre_ping=True, pool_recycle=3600)
+# One session per request thread; app.py removes it in teardown_request
+SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 Base = declarative_base()
 
 class User(Base):
@@ -18,12 +23,18 @@ class User(Base):
 class Project(Base):
     __tablename__ = "projects"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String(200), nullable=False)
     filters_json = Column(Text, nullable=False)
     bbox = Column(String(200), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Serves list_projects: WHERE user_id = ? ORDER BY created_at DESC
+Index("ix_projects_user_created", Project.user_id, Project.created_at.desc())
+
 def init_db():
     Base.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add any missing indexes to older databases
+    for ix in Project.__table__.indexes:
+        ix.create(engine, checkfirst=True)
 
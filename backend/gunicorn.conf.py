@@ -0,0 +1,21 @@
+# backend/gunicorn.conf.py — run with: gunicorn -c gunicorn.conf.py app:app
+# Patch sockets/threads before the app is imported by preload_app
+from gevent import monkey
+monkey.patch_all()
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_connections = 1000
+keepalive = 5
+# Worker heartbeat timeout, not a per-request bound for gevent workers;
+# each Socrata GET (retries included) is capped by data_fetch.FETCH_DEADLINE
+timeout = 60
+preload_app = True
+
+def post_fork(server, worker):
+    # Don't share pooled DB connections opened in the master with the forked workers
+    from db import engine
+    engine.dispose(close=False)
@@ -1,6 +1,9 @@
 # backend/services/data_fetch.py
-import os, requests
-from typing import Any, Dict, List
+import os, asyncio, atexit, threading
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import aiohttp
+from cachetools import TTLCache
 
 DATASETS = {
     "buildings_3d": "cchr-krqg",   # 3D buildings
@@ -10,57 +13,195 @@ DATASETS = {
 }
 
 APP_TOKEN = os.environ.get("SOCRATA_APP_TOKEN")
-HEADERS = {"X-App-Token": APP_TOKEN} if APP_TOKEN else {}
+HEADERS = {"Accept-Encoding": "gzip"}
+if APP_TOKEN:
+    HEADERS["X-App-Token"] = APP_TOKEN
 CANDIDATE_GEOMS = ["geometry", "the_geom", "shape", "geom", "multipolygon"]
 
-def _safe_get(url, params):
+# Coordinates are handled as int degrees * 1e8, snapped to BBOX_DECIMALS,
+# so cache keys are exact integer tuples with no float noise
+FIXED_SCALE = 10**8
+BBOX_DECIMALS = 5  # ~1 m; nearly-identical viewports share a cache entry
+_SNAP = 10**(8 - BBOX_DECIMALS)
+
+# Responses keyed on (dataset_id, fixed bbox, limit); only touched on the event-loop thread
+_CACHE = TTLCache(maxsize=512, ttl=600)
+# Empty results are only remembered briefly: they may be a transient upstream failure
+_EMPTY = TTLCache(maxsize=512, ttl=60)
+# First CANDIDATE_GEOMS entry that returned features, per dataset
+_GEOM_FIELD: Dict[str, str] = {}
+# In-flight geometry-field probe per dataset, so concurrent cold requests share one
+_PROBES: Dict[str, "asyncio.Future"] = {}
+
+# ---------- Event loop ----------
+# All HTTP runs on one background event loop with one shared aiohttp session, so
+# keep-alive connections are reused across requests and every fetch/probe of a
+# request is multiplexed concurrently. Sync callers (Flask handlers) block on _run().
+_RETRIES = 2
+_BACKOFF = 0.3
+FETCH_DEADLINE = 30  # seconds for one GET including retries; timeouts are not retried
+# Open connections to Socrata across the whole process; 0 = unlimited. The loop serves
+# every gevent greenlet of the worker, so a small cap would queue unrelated requests.
+MAX_CONNECTIONS = int(os.environ.get("SOCRATA_MAX_CONNECTIONS", 0))
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+
+def _new_loop():
+    # uvloop blocks in libuv, which would stall gevent's hub; only use it without gevent
     try:
-        r = requests.get(url, params=params, headers=HEADERS, timeout=30)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
-        return {"type": "FeatureCollection", "features": []}
+        from gevent import monkey
+        if monkey.is_module_patched("socket"):
+            return asyncio.new_event_loop()
+    except ImportError:
+        pass
+    try:
+        import uvloop
+        return uvloop.new_event_loop()
+    except ImportError:
+        return asyncio.new_event_loop()
+
+def _run(coro):
+    """Run a coroutine on the background loop and wait for its result."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = _new_loop()
+            threading.Thread(target=_loop.run_forever, name="data-fetch-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+def _get_session() -> aiohttp.ClientSession:
+    # Only ever called on the loop thread, so no lock is needed
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS),
+        )
+    return _session
+
+@atexit.register
+def _close_session():
+    if _session is not None and not _session.closed:
+        _run(_session.close())
+
+async def _safe_get(url, params):
+    deadline = asyncio.get_running_loop().time() + FETCH_DEADLINE
+    for attempt in range(_RETRIES + 1):
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        try:
+            async with _get_session().get(url, params=params,
+                                          timeout=aiohttp.ClientTimeout(total=remaining)) as r:
+                if r.status < 400:
+                    return await r.json(content_type=None)
+                if r.status < 500:
+                    break  # e.g. wrong geometry field name; retrying won't help
+        except asyncio.TimeoutError:
+            break  # the whole budget is spent; a retry could only time out again
+        except Exception:
+            pass
+        if attempt < _RETRIES:
+            await asyncio.sleep(_BACKOFF * 2**attempt)
+    return {"type": "FeatureCollection", "features": []}
+# --------------------------------
+
+def _to_fixed(x: float) -> int:
+    return int(round(x * 10**BBOX_DECIMALS)) * _SNAP
 
-def socrata_geojson(dataset_id: str, minLon: float, minLat: float, maxLon: float, maxLat: float, limit=5000):
+def _fmt_fixed(v: int) -> str:
+    """Exact decimal string for a fixed-point coordinate (no float round-trip)."""
+    q, r = divmod(abs(v), FIXED_SCALE)
+    return f"{'-' if v < 0 else ''}{q}.{r:08d}"
+
+def fixed_bbox(bbox: str) -> Tuple[int, int, int, int]:
+    """Parse 'minLon,minLat,maxLon,maxLat' once into snapped fixed-point ints."""
+    minLon, minLat, maxLon, maxLat = (_to_fixed(float(x)) for x in bbox.split(","))
+    return minLon, minLat, maxLon, maxLat
+
+def format_bbox(fb: Tuple[int, int, int, int]) -> str:
+    return ",".join(_fmt_fixed(v) for v in fb)
+
+async def _socrata_fixed(dataset_id: str, fb: Tuple[int, int, int, int], limit=5000):
     """
     Socrata within_box expects: (north_lat, west_lon, south_lat, east_lon),
-    and field name varies by dataset.
+    and field name varies by dataset. Non-empty responses are cached for 10 minutes,
+    empty ones for a minute.
     """
-    north, south = maxLat, minLat
-    west,  east  = minLon, maxLon
+    key = (dataset_id, *fb, limit)
+    cached = _CACHE.get(key)
+    if cached is not None:
+        return cached
+    if key in _EMPTY:
+        return {"type": "FeatureCollection", "features": []}
+
+    data = await _fetch_geojson(dataset_id, *fb, limit)
+    if data.get("features"):
+        _CACHE[key] = data
+    else:
+        _EMPTY[key] = True
+    return data
+
+async def _fetch_geojson(dataset_id: str, minLon: int, minLat: int, maxLon: int, maxLat: int, limit: int):
+    north, south = _fmt_fixed(maxLat), _fmt_fixed(minLat)
+    west,  east  = _fmt_fixed(minLon), _fmt_fixed(maxLon)
 
     base = f"https://data.calgary.ca/resource/{dataset_id}.geojson"
-    for field in CANDIDATE_GEOMS:
+    def get(field):
         params = {
             "$limit": limit,
             "$where": f"within_box({field}, {north}, {west}, {south}, {east})"
         }
-        data = _safe_get(base, params)
-        feats = data.get("features") or []
-        if feats:
+        return _safe_get(base, params)
+
+    # Known geometry field: one request, and an empty answer is a real empty bbox
+    field = _GEOM_FIELD.get(dataset_id)
+    if field:
+        return await get(field)
+
+    # Another request is already probing this dataset: wait for it to learn the field
+    probe = _PROBES.get(dataset_id)
+    if probe is not None:
+        await asyncio.wait({probe})
+        field = _GEOM_FIELD.get(dataset_id)
+        if field:
+            return await get(field)
+
+    # Unknown: probe all candidates at once, prefer the earliest in CANDIDATE_GEOMS order
+    probe = asyncio.ensure_future(asyncio.gather(*(get(f) for f in CANDIDATE_GEOMS)))
+    _PROBES.setdefault(dataset_id, probe)
+    try:
+        results = await probe
+    finally:
+        if _PROBES.get(dataset_id) is probe:
+            del _PROBES[dataset_id]
+    for field, data in zip(CANDIDATE_GEOMS, results):
+        if data.get("features"):
+            _GEOM_FIELD[dataset_id] = field
             return data
     return {"type": "FeatureCollection", "features": []}
 
-def fetch_buildings_bbox(bbox: str) -> List[Dict[str, Any]]:
-    minLon, minLat, maxLon, maxLat = [float(x) for x in bbox.split(",")]
+async def _buildings(fb) -> List[Dict[str, Any]]:
     # Try 3D first
-    gj3 = socrata_geojson(DATASETS["buildings_3d"], minLon, minLat, maxLon, maxLat)
+    gj3 = await _socrata_fixed(DATASETS["buildings_3d"], fb)
     feats = gj3.get("features") or []
     if feats:
         return feats
     # Fallback to 2D
-    gj2 = socrata_geojson(DATASETS["buildings_2d"], minLon, minLat, maxLon, maxLat)
+    gj2 = await _socrata_fixed(DATASETS["buildings_2d"], fb)
     return gj2.get("features") or []
 
-def fetch_land_use_bbox(bbox: str) -> List[Dict[str, Any]]:
-    minLon, minLat, maxLon, maxLat = [float(x) for x in bbox.split(",")]
-    gj = socrata_geojson(DATASETS["land_use"], minLon, minLat, maxLon, maxLat)
+async def _layer(dataset: str, fb) -> List[Dict[str, Any]]:
+    gj = await _socrata_fixed(DATASETS[dataset], fb)
     return gj.get("features") or []
 
-def fetch_assessments_bbox(bbox: str) -> List[Dict[str, Any]]:
-    minLon, minLat, maxLon, maxLat = [float(x) for x in bbox.split(",")]
-    gj = socrata_geojson(DATASETS["assessments"], minLon, minLat, maxLon, maxLat)
-    return gj.get("features") or []
+def fetch_scene_bbox(bbox: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(buildings, land_use, assessments) raw features, all fetched concurrently on one loop."""
+    fb = fixed_bbox(bbox)
+    async def gather():
+        return await asyncio.gather(_buildings(fb), _layer("land_use", fb), _layer("assessments", fb))
+    return tuple(_run(gather()))
 
 def _first(props: dict, keys: List[str], default=None):
     for k in keys:
@@ -69,8 +210,18 @@ def _first(props: dict, keys: List[str], default=None):
             return v
     return default
 
-def norm_building(f):
-    """Normalize a Calgary footprint feature into our schema."""
+class BuildingRow(NamedTuple):
+    """One normalized building; BuildingScene keeps one column per field."""
+    id: Any
+    geometry: Optional[Dict[str, Any]]
+    height_m: float
+    levels: int
+    address: Optional[str]
+    zoning: Optional[str]
+    raw: Dict[str, Any]
+
+def building_row(f) -> BuildingRow:
+    """Normalized building attributes for a Calgary footprint feature."""
     props = f.get("properties", {}) or {}
     geom  = f.get("geometry")
 
@@ -112,34 +263,46 @@ def norm_building(f):
     if height_m is None:
         height_m = 12.0
 
-    return {
-        "id": props.get("objectid") or props.get("id") or props.get("OBJECTID") or props.get("bldg_id") or props.get("BLDG_ID") or props.get("mapid") or props.get("MAPID"),
-        "geometry": geom,
-        "height_m": float(height_m),
-        "levels": levels if levels is not None else round(float(height_m)/3.0),
-        "address": props.get("address") or props.get("ADDRESS") or props.get("civic_address"),
-        "zoning": props.get("zoning") or props.get("ZONING") or props.get("land_use") or props.get("LAND_USE"),
-        "assessed_value": None,  # filled later by assessment overlay
-        "raw": props,
-    }
+    return BuildingRow(
+        id=props.get("objectid") or props.get("id") or props.get("OBJECTID") or props.get("bldg_id") or props.get("BLDG_ID") or props.get("mapid") or props.get("MAPID"),
+        geometry=geom,
+        height_m=float(height_m),
+        levels=levels if levels is not None else round(float(height_m)/3.0),
+        address=props.get("address") or props.get("ADDRESS") or props.get("civic_address"),
+        zoning=props.get("zoning") or props.get("ZONING") or props.get("land_use") or props.get("LAND_USE"),
+        raw=props,
+    )
 
 
+_LAND_KEYS = frozenset({"land_use_district","landuse_district","landuse","district","zone","zoning"})
+_LAND_FAST = ("land_use_district", "zoning", "landuse")  # common exact keys, tried before scanning
+
 def norm_land_use(f):
     p = f.get("properties") or {}
     g = f.get("geometry")
     z = None
-    for k in p.keys():
-        if k.lower() in ["land_use_district","landuse_district","landuse","district","zone","zoning"]:
-            z = p.get(k); break
+    for k in _LAND_FAST:
+        z = p.get(k)
+        if z:
+            break
+    else:
+        for k, v in p.items():
+            if k.casefold() in _LAND_KEYS:
+                z = v; break
     return {"zoning": z or "Unknown", "geometry": g, "raw": p}
 
+@lru_cache(maxsize=256)
+def _is_assessed_key(k: str) -> bool:
+    # Property keys repeat across every feature of a dataset, so each is only lowercased once
+    kl = k.lower()
+    return "assessed" in kl and ("value" in kl or "total" in kl)
+
 def norm_assess(f):
     p = f.get("properties") or {}
     g = f.get("geometry")
     val = None
     for k,v in p.items():
-        kl = str(k).lower()
-        if "assessed" in kl and ("value" in kl or "total" in kl):
+        if _is_assessed_key(str(k)):
             try:
                 val = float(str(v).replace(",","")); break
             except Exception:
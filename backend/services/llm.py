@@ -1,5 +1,5 @@
 # backend/services/llm.py
-import os, re, json
+import os, re, json, functools
 from typing import List, Tuple, Dict, Any
 
 SYSTEM_PROMPT = """You extract structured filters from a natural-language query about buildings.
@@ -19,6 +19,14 @@ Input: show buildings in RC-G zoning
 Output: {"filters":[{"attribute":"zoning","operator":"=","value":"RC-G"}]}
 """
 
+# Compiled once at import; the fallback parser runs on every LLM-filter request
+_RE_FEET   = re.compile(r"(\d+(?:\.\d+)?)\s*(?:ft|feet)\b")
+_RE_METERS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:m|meter|meters)\b")
+_RE_LEVELS = re.compile(r"(\d+)\s*(?:levels?|storeys?|stories?)\b")
+_RE_ZONE   = re.compile(r"\b([A-Z]{1,3}-[A-Z]{1,3})\b")  # e.g., RC-G, C-COR
+_RE_MONEY  = re.compile(r"\$?\s*([\d,]+(?:\.\d+)?)\b")
+_RE_JSON   = re.compile(r"\{.*\}", re.S)
+
 # ---------- FALLBACK PARSER (always available) ----------
 def _fallback_rule_based(q: str) -> List[Dict[str, Any]]:
     ql = q.lower()
@@ -32,11 +40,11 @@ def _fallback_rule_based(q: str) -> List[Dict[str, Any]]:
     )
 
     # Extractors
-    m_feet   = re.search(r"(\d+(?:\.\d+)?)\s*(?:ft|feet)\b", ql)
-    m_meters = re.search(r"(\d+(?:\.\d+)?)\s*(?:m|meter|meters)\b", ql)
-    m_levels = re.search(r"(\d+)\s*(?:levels?|storeys?|stories?)\b", ql)
-    m_zone   = re.search(r"\b([A-Z]{1,3}-[A-Z]{1,3})\b", q)  # e.g., RC-G, C-COR
-    m_money  = re.search(r"\$?\s*([\d,]+(?:\.\d+)?)\b", ql) if money_hint else None
+    m_feet   = _RE_FEET.search(ql)
+    m_meters = _RE_METERS.search(ql)
+    m_levels = _RE_LEVELS.search(ql)
+    m_zone   = _RE_ZONE.search(q)
+    m_money  = _RE_MONEY.search(ql) if money_hint else None
 
     # Operator heuristics (applies to whichever attribute we found)
     op = ">"
@@ -79,6 +87,13 @@ def _fallback_rule_based(q: str) -> List[Dict[str, Any]]:
     return filters
 
 
+@functools.lru_cache(maxsize=8)
+def _client(model: str, token: str):
+    """One InferenceClient per (model, token); building one per request redoes the auth setup."""
+    from huggingface_hub import InferenceClient
+    return InferenceClient(model=model, token=token)
+
+
 # ---------- MAIN ENTRY ----------
 def parse_filters(query: str) -> Tuple[List[Dict[str, Any]], str]:
     """
@@ -99,7 +114,7 @@ def parse_filters(query: str) -> Tuple[List[Dict[str, Any]], str]:
 
     # Import client lazily so missing package falls back cleanly
     try:
-        from huggingface_hub import InferenceClient
+        import huggingface_hub  # noqa: F401
     except ModuleNotFoundError:
         return _fallback_rule_based(query) or [], "fallback_error:missing_huggingface_hub"
 
@@ -108,8 +123,7 @@ def parse_filters(query: str) -> Tuple[List[Dict[str, Any]], str]:
 
     for model in candidates:
         try:
-            client = InferenceClient(model=model, token=token)
-            resp = client.text_generation(
+            resp = _client(model, token).text_generation(
                 prompt,
                 max_new_tokens=200,
                 temperature=0.1,
@@ -117,7 +131,7 @@ def parse_filters(query: str) -> Tuple[List[Dict[str, Any]], str]:
                 repetition_penalty=1.05,
             )
             # resp is a string; extract first {...}
-            m = re.search(r"\{.*\}", resp, flags=re.S)
+            m = _RE_JSON.search(resp)
             if not m:
                 last_err = "no_json"
                 continue
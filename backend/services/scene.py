@@ -0,0 +1,93 @@
+# backend/services/scene.py
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import numpy as np
+
+from services.data_fetch import BuildingRow, building_row
+
+NUMERIC_ATTRS = ("height_m", "assessed_value", "levels")
+
+@dataclass
+class BuildingScene:
+    """
+    Buildings stored column-wise: enrichment and filtering are array writes and
+    compares, and feature dicts are only built once, at response time.
+    """
+    ids: np.ndarray             # object
+    heights: np.ndarray         # float64
+    levels: np.ndarray          # int64
+    address: np.ndarray         # object
+    zoning: np.ndarray          # object
+    assessed_value: np.ndarray  # float64, NaN = unknown
+    geoms: List[Any]            # GeoJSON geometry dicts (None if missing)
+    raw: List[Dict[str, Any]]   # source properties
+
+    @classmethod
+    def from_features(cls, features) -> "BuildingScene":
+        """Normalize raw Socrata building features straight into columns."""
+        rows = [building_row(f) for f in features]
+        # Transpose into a BuildingRow of columns, so fields are read by name
+        cols = BuildingRow(*zip(*rows)) if rows else BuildingRow(*[()] * len(BuildingRow._fields))
+        return cls(
+            ids=_object_array(cols.id),
+            heights=np.array(cols.height_m, dtype=np.float64),
+            levels=np.array(cols.levels, dtype=np.int64),
+            address=_object_array(cols.address),
+            zoning=_object_array(cols.zoning),
+            assessed_value=np.full(len(rows), np.nan),
+            geoms=list(cols.geometry),
+            raw=list(cols.raw),
+        )
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def take(self, idx) -> "BuildingScene":
+        """Subset of the scene at integer positions idx."""
+        return BuildingScene(
+            ids=self.ids[idx],
+            heights=self.heights[idx],
+            levels=self.levels[idx],
+            address=self.address[idx],
+            zoning=self.zoning[idx],
+            assessed_value=self.assessed_value[idx],
+            geoms=[self.geoms[i] for i in idx],
+            raw=[self.raw[i] for i in idx],
+        )
+
+    def column(self, attr: str) -> np.ndarray:
+        """Filterable column: float64 for numeric attributes, lower-cased str otherwise."""
+        col = {
+            "id": self.ids,
+            "height_m": self.heights,
+            "levels": self.levels,
+            "address": self.address,
+            "zoning": self.zoning,
+            "assessed_value": self.assessed_value,
+        }.get(attr)
+        if attr in NUMERIC_ATTRS:
+            return np.full(len(self), np.nan) if col is None else col.astype(np.float64)
+        if col is None:
+            return np.full(len(self), "", dtype=str)
+        return np.array([str(v or "").lower() for v in col], dtype=str)
+
+    def to_features(self) -> List[Dict[str, Any]]:
+        """GeoJSON-ish feature dicts in the /api/scene schema."""
+        values = [None if v != v else v for v in self.assessed_value.tolist()]  # NaN -> None
+        return [
+            {
+                "id": i, "geometry": g, "height_m": h, "levels": lv, "address": a,
+                "zoning": z, "assessed_value": v, "raw": r,
+            }
+            for i, g, h, lv, a, z, v, r in zip(
+                self.ids.tolist(), self.geoms, self.heights.tolist(), self.levels.tolist(),
+                self.address.tolist(), self.zoning.tolist(), values, self.raw,
+            )
+        ]
+
+def _object_array(values) -> np.ndarray:
+    # np.array(list_of_mixed) may try to build a 2-D or numeric array; fill an object array instead
+    out = np.empty(len(values), dtype=object)
+    out[:] = list(values)
+    return out
@@ -0,0 +1,128 @@
+# backend/services/scene_cache.py
+import os, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from cachetools import LRUCache
+
+from services.data_fetch import fixed_bbox, format_bbox
+
+SCENE_TTL = 600       # seconds before an entry is refreshed in the background
+SCENE_MAX_AGE = 3600  # older entries are rebuilt synchronously instead of served stale
+
+_LOCAL = LRUCache(maxsize=64)   # fixed bbox tuple -> (stored_at, features)
+_LOCK = threading.Lock()
+_PENDING = set()                # keys with a refresh already queued
+_BUILDS: Dict[Tuple[int, ...], Future] = {}  # in-flight synchronous builds, shared by concurrent misses
+_REFRESH = ThreadPoolExecutor(max_workers=2)
+
+REDIS_TIMEOUT = 0.5      # seconds; a stalled Redis must not stall /api/scene
+REDIS_RETRY_AFTER = 30   # seconds to stay on the local cache after a Redis error
+
+_redis_client = None
+_redis_down_until = 0.0
+
+def _redis():
+    """
+    Shared Redis client when REDIS_URL is set (multi-worker deployments); None otherwise,
+    or while backing off after a recent Redis error.
+    """
+    global _redis_client
+    url = os.environ.get("REDIS_URL")
+    if not url or time.monotonic() < _redis_down_until:
+        return None
+    if _redis_client is None:
+        try:
+            import redis
+        except ModuleNotFoundError:
+            return None
+        _redis_client = redis.Redis.from_url(url, socket_connect_timeout=REDIS_TIMEOUT,
+                                             socket_timeout=REDIS_TIMEOUT)
+    return _redis_client
+
+def _redis_failed(e: Exception):
+    global _redis_down_until
+    print("SCENE CACHE ERROR:", repr(e))
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+
+def _redis_key(key: Tuple[int, ...]) -> str:
+    return "scene:" + ",".join(map(str, key))
+
+def _get(key: Tuple[int, ...]) -> Optional[Tuple[float, List[Any]]]:
+    r = _redis()
+    if r is not None:
+        try:
+            raw = r.get(_redis_key(key))
+            if raw:
+                obj = orjson.loads(raw)
+                return obj["t"], obj["features"]
+            return None
+        except Exception as e:
+            _redis_failed(e)
+    with _LOCK:
+        return _LOCAL.get(key)
+
+def _put(key: Tuple[int, ...], features: List[Any]):
+    # Empty scenes are usually upstream failures; don't pin them
+    if not features:
+        return
+    now = time.time()
+    r = _redis()
+    if r is not None:
+        try:
+            r.setex(_redis_key(key), SCENE_MAX_AGE,
+                    orjson.dumps({"t": now, "features": features}, option=orjson.OPT_SERIALIZE_NUMPY))
+            return
+        except Exception as e:
+            _redis_failed(e)
+    with _LOCK:
+        _LOCAL[key] = (now, features)
+
+def _refresh(key: Tuple[int, ...], build: Callable[[str], List[Any]]):
+    try:
+        _put(key, build(format_bbox(key)))
+    except Exception as e:
+        print("SCENE REFRESH ERROR:", repr(e))
+    finally:
+        with _LOCK:
+            _PENDING.discard(key)
+
+def get_scene(bbox: str, build: Callable[[str], List[Any]]) -> List[Any]:
+    """
+    Enriched features for bbox, built by build(snapped bbox string) on a miss.
+    Entries past SCENE_TTL are served stale while a background refresh runs.
+    """
+    key = fixed_bbox(bbox)
+    entry = _get(key)
+    if entry is not None:
+        stored_at, features = entry
+        age = time.time() - stored_at
+        if age < SCENE_MAX_AGE:
+            if age > SCENE_TTL:
+                with _LOCK:
+                    queue = key not in _PENDING
+                    _PENDING.add(key)
+                if queue:
+                    _REFRESH.submit(_refresh, key, build)
+            return features
+
+    # Miss: one request builds, concurrent requests for the same key wait on its result
+    with _LOCK:
+        fut = _BUILDS.get(key)
+        leader = fut is None
+        if leader:
+            fut = _BUILDS[key] = Future()
+    if not leader:
+        return fut.result()
+    try:
+        features = build(format_bbox(key))
+        _put(key, features)
+        fut.set_result(features)
+        return features
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _LOCK:
+            del _BUILDS[key]